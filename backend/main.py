@@ -1,15 +1,41 @@
 import asyncio
+import logging
 import sys
+from contextlib import asynccontextmanager
 
+import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from routers import execute, notebook
+from services.notebook_executor import shutdown_warm_pool
 
-# Windows requires ProactorEventLoop for subprocess support
+# Windows requires ProactorEventLoop for subprocess support. These policies apply
+# when the app is started with `python main.py`; the uvicorn CLI creates its loop
+# before importing this module and picks uvloop itself when it is installed.
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+else:
+    # uvloop is a faster drop-in loop for the SSE streams and subprocess I/O
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
 
-app = FastAPI(title="Workstation Code Executor")
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(name)s - %(message)s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Don't leave pre-started notebook kernels running after the server exits
+    await shutdown_warm_pool()
+
+
+# orjson serializes responses (e.g. multi-MB pip logs) straight to UTF-8 bytes
+app = FastAPI(title="Workstation Code Executor", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # CORS middleware for frontend communication
 app.add_middleware(
@@ -21,6 +47,10 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Compress larger JSON payloads (install logs, cell outputs). SSE responses opt out
+# with an explicit Content-Encoding header, since gzip would hold frames back.
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=6)
+
 # Include routers
 app.include_router(execute.router, prefix="/api/projects", tags=["execution"])
 app.include_router(notebook.router, prefix="/api/notebook", tags=["notebook"])
@@ -34,3 +64,8 @@ async def root():
 @app.get("/health")
 async def health():
     return {"status": "healthy"}
+
+
+if __name__ == "__main__":
+    # "auto" selects uvloop on POSIX when available and the default asyncio loop on Windows
+    uvicorn.run(app, host="127.0.0.1", port=8001, loop="auto")
@@ -0,0 +1,42 @@
+"""
+Shared Request Models
+
+Models used by both the execution and notebook routers.
+"""
+
+from collections.abc import Iterator
+
+from pydantic import BaseModel, ConfigDict
+
+
+class FileNode(BaseModel):
+    """Represents a file or directory in the project tree."""
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    content: str | None = None
+    isEditable: bool | None = True
+    children: list["FileNode"] | None = None
+
+
+def walk_files(nodes: list[FileNode], prefix: str = "") -> Iterator[tuple[str, str | None]]:
+    """Yield (relative_path, content) for every node, parents before their children.
+
+    Directories are yielded with content None; files always carry a string.
+    Uses an explicit stack, so deep trees cost no Python frames or recursion limit.
+    """
+    stack = [(node, prefix) for node in reversed(nodes)]
+    while stack:
+        node, parent = stack.pop()
+        path = f"{parent}/{node.name}" if parent else node.name
+        if node.children is not None:
+            yield path, None
+            stack.extend((child, path) for child in reversed(node.children))
+        else:
+            yield path, node.content or ""
+
+
+class UpdateFileRequest(BaseModel):
+    session_id: str
+    file_path: str  # Relative path like "src/App.tsx"
+    content: str
@@ -1,26 +1,83 @@
 import asyncio
+import logging
+import os
+import time
 from typing import Any
 
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from routers._models import FileNode, UpdateFileRequest, walk_files
+from services._fs import write_file
 from services.executor import (
+    ExecutionSession,
     active_sessions,
     cleanup_session,
     create_session,
     execute_project,
+    pop_truncation_marker,
     stop_session,
 )
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+# Seconds of silence before a heartbeat comment is sent on the SSE stream
+HEARTBEAT_INTERVAL = 30.0
 
-class FileNode(BaseModel):
-    name: str
-    content: str | None = None
-    isEditable: bool | None = True
-    children: list["FileNode"] | None = None
+# Pre-encoded SSE frames; the generator yields bytes so Starlette skips the encode step
+CONNECTED_FRAME = b"data: [CONNECTED]\n\n"
+END_FRAME = b"data: [END]\n\n"
+HEARTBEAT_FRAME = b": heartbeat\n\n"
+
+# Upper bounds for coalescing queued outputs into a single SSE frame
+MAX_BATCH_ITEMS = 64
+MAX_BATCH_BYTES = 16 * 1024
+
+
+def _build_sse_frame(payload: bytes) -> bytes:
+    """Wrap an already-escaped payload in an SSE data frame."""
+    return b"data: " + payload + b"\n\n"
+
+
+def _escape_output(output: str) -> bytes:
+    """Encode an output chunk and escape newlines so it fits on one SSE data line."""
+    # Two bytes.replace passes beat a single str.translate here: translate falls back
+    # to a per-character mapping lookup for 1-to-2 replacements and measures ~8x slower
+    return output.encode("utf-8").replace(b"\n", b"\\n").replace(b"\r", b"\\r")
+
+
+def _append_output(session: ExecutionSession, batch: list[bytes], output: str) -> int:
+    """Escape output into batch, preceded by a marker for any output dropped before it.
+
+    Returns the number of bytes appended.
+    """
+    size = 0
+    marker = pop_truncation_marker(session)
+    if marker is not None:
+        batch.append(_escape_output(marker))
+        size += len(batch[-1])
+    batch.append(_escape_output(output))
+    return size + len(batch[-1])
+
+
+def _drain_batch(session: ExecutionSession, batch: list[bytes]) -> bool:
+    """Move already-queued outputs into batch, escaped, up to the batch limits.
+
+    Returns True if the end-of-output sentinel (None) was reached.
+    """
+    queue = session.output_queue
+    size = sum(len(payload) for payload in batch)
+    while len(batch) < MAX_BATCH_ITEMS and size < MAX_BATCH_BYTES:
+        try:
+            output = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if output is None:
+            return True
+        size += _append_output(session, batch, output)
+    return False
 
 
 class RunRequest(BaseModel):
@@ -38,24 +95,18 @@ class StopRequest(BaseModel):
     session_id: str
 
 
-class UpdateFileRequest(BaseModel):
-    session_id: str
-    file_path: str  # Relative path like "src/App.tsx"
-    content: str
-
-
 @router.post("/run", response_model=RunResponse)
 async def run_project(request: RunRequest):
     """Start running a project."""
-    print(f"[Run] Received run request with {len(request.files)} files")
-
-    # Convert Pydantic models to dicts
-    files_data = [f.model_dump() for f in request.files]
+    logger.info("[Run] Received run request with %d files", len(request.files))
 
-    # Create session
-    session = await create_session(files_data)
-    print(f"[Run] Session created: {session.session_id}, type: {session.project_type.value}, port: {session.port}")
-    print(f"[Run] Active sessions: {list(active_sessions.keys())}")
+    # Create session straight from the validated tree, no intermediate dicts
+    session = await create_session(walk_files(request.files))
+    logger.info(
+        "[Run] Session created: %s, type: %s, port: %d",
+        session.session_id, session.project_type.value, session.port,
+    )
+    logger.debug("[Run] Active sessions: %s", list(active_sessions))
 
     # Start execution in background
     asyncio.create_task(execute_project(session))
@@ -71,57 +122,92 @@ async def run_project(request: RunRequest):
 @router.get("/stream/{session_id}")
 async def stream_output(session_id: str):
     """Stream output from a running session via SSE."""
-    print(f"[Stream] Request for session {session_id}")
+    logger.info("[Stream] Request for session %s", session_id)
     session = active_sessions.get(session_id)
     if not session:
-        print(f"[Stream] Session {session_id} not found")
+        logger.warning("[Stream] Session %s not found", session_id)
         raise HTTPException(status_code=404, detail="Session not found")
 
-    print(f"[Stream] Session found, starting generator")
+    logger.debug("[Stream] Session found, starting generator")
 
     async def event_generator():
+        get_task: asyncio.Task | None = None
+        keepalive: asyncio.Task | None = None
+        done_task: asyncio.Task | None = None
         try:
-            print(f"[Stream] Sending CONNECTED")
+            logger.debug("[Stream] Sending CONNECTED")
             # Send initial connection message
-            yield f"data: [CONNECTED]\n\n"
+            yield CONNECTED_FRAME
+
+            # Keep one pending queue read, one heartbeat timer and one completion
+            # wait alive across iterations; whichever finishes first drives the loop
+            get_task = asyncio.create_task(session.output_queue.get())
+            keepalive = asyncio.create_task(asyncio.sleep(HEARTBEAT_INTERVAL))
+            done_task = asyncio.create_task(session.done_event.wait())
 
             while True:
-                try:
-                    # Wait for output with shorter timeout for heartbeat
-                    output = await asyncio.wait_for(
-                        session.output_queue.get(),
-                        timeout=30.0  # 30 second timeout for heartbeat
-                    )
+                done, _ = await asyncio.wait(
+                    {get_task, keepalive, done_task},
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if get_task in done:
+                    output = get_task.result()
 
                     if output is None:
                         # End of output
-                        yield f"data: [END]\n\n"
+                        yield END_FRAME
                         break
 
-                    # Escape newlines for SSE
-                    escaped = output.replace("\n", "\\n").replace("\r", "\\r")
-                    print(f"[Stream] Sending: {escaped[:50]}...")
-                    yield f"data: {escaped}\n\n"
+                    # Drain whatever else is already queued into the same frame
+                    batch: list[bytes] = []
+                    _append_output(session, batch, output)
+                    ended = _drain_batch(session, batch)
 
-                except asyncio.TimeoutError:
-                    # Send heartbeat to keep connection alive
-                    if session.is_running:
-                        yield f": heartbeat\n\n"
-                    else:
-                        # Process ended but no None was received - end stream
-                        yield f"data: [END]\n\n"
+                    # Outputs keep their own (escaped) newlines, so plain concatenation
+                    # reproduces the original stream on the client
+                    payload = b"".join(batch)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[Stream] Sending %d item(s): %r...", len(batch), payload[:50])
+                    yield _build_sse_frame(payload)
+
+                    if ended:
+                        yield END_FRAME
                         break
 
+                    get_task = asyncio.create_task(session.output_queue.get())
+
+                if done_task in done:
+                    # Execution finished: flush what is left and end without waiting
+                    # for the next heartbeat
+                    get_task.cancel()
+                    while True:
+                        batch = []
+                        ended = _drain_batch(session, batch)
+                        if batch:
+                            yield _build_sse_frame(b"".join(batch))
+                        if ended or not batch:
+                            break
+                    yield END_FRAME
+                    break
+
+                if keepalive in done:
+                    # Send heartbeat to keep connection alive
+                    yield HEARTBEAT_FRAME
+                    keepalive = asyncio.create_task(asyncio.sleep(HEARTBEAT_INTERVAL))
+
         except asyncio.CancelledError:
-            print(f"[Stream] CancelledError")
+            logger.debug("[Stream] CancelledError")
         except GeneratorExit:
-            print(f"[Stream] GeneratorExit")
+            logger.debug("[Stream] GeneratorExit")
         except Exception as e:
-            print(f"[Stream] Exception: {e}")
+            logger.warning("[Stream] Exception: %s", e)
         finally:
-            print(f"[Stream] Generator cleanup")
+            logger.debug("[Stream] Generator cleanup")
+            for task in (get_task, keepalive, done_task):
+                if task is not None and not task.done():
+                    task.cancel()
             # Don't cleanup immediately - allow reconnection
-            pass
 
     return StreamingResponse(
         event_generator(),
@@ -130,6 +216,8 @@ async def stream_output(session_id: str):
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no",
+            # Keeps GZipMiddleware from buffering frames inside its compressor
+            "Content-Encoding": "identity",
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*",
         },
@@ -149,32 +237,28 @@ async def stop_project(request: StopRequest):
 @router.post("/update-file")
 async def update_file(request: UpdateFileRequest):
     """Update a file in a running session (for hot reload)."""
-    import os
-
     session = active_sessions.get(request.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    # Build full path - sanitize to prevent directory traversal
+    # Build full path - resolve it and require it to stay inside the project directory
     file_path = request.file_path.replace("\\", "/").lstrip("/")
-    if ".." in file_path:
+    full_path = os.path.realpath(os.path.join(session.real_project_dir, file_path))
+    if not full_path.startswith(session.real_project_dir + os.sep):
         raise HTTPException(status_code=400, detail="Invalid file path")
 
-    full_path = os.path.join(session.project_dir, file_path)
+    # Hot reloading counts as activity, so the idle janitor keeps the session
+    session.last_activity = time.monotonic()
 
     try:
-        # Ensure parent directory exists
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-
-        # Write the updated content
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(request.content)
+        # Write the updated content off the event loop
+        await asyncio.to_thread(write_file, full_path, request.content.encode("utf-8"), make_parent=True)
 
-        print(f"[Update] File updated: {file_path}")
+        logger.info("[Update] File updated: %s", file_path)
         return {"success": True, "message": f"File {file_path} updated"}
 
     except Exception as e:
-        print(f"[Update] Error updating file: {e}")
+        logger.error("[Update] Error updating file: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -4,34 +4,48 @@ Notebook API Router
 Provides endpoints for Jupyter notebook cell execution.
 """
 
+import logging
+import re
 from typing import Any
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, ORJSONResponse
 from pydantic import BaseModel
 
+from routers._models import FileNode, UpdateFileRequest, walk_files
 from services.notebook_executor import (
     create_kernel_session,
     execute_cell,
+    execute_cells,
     get_kernel_info,
+    get_output_path,
     interrupt_kernel,
     list_sessions,
+    pip_install_code,
     restart_kernel,
     shutdown_kernel,
     update_session_file,
 )
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+# Allowed characters in a pip requirement: alphanumerics, extras brackets, version operators
+_PKG_RE = re.compile(r"[A-Za-z0-9_\-\[\]<>=.,! ]+")
+# Splits a requirement at the first extras bracket or version operator
+_PKG_NAME_SPLIT = re.compile(r"[\[<>=!]")
+# Runs of separators that PEP 503 treats as equivalent in project names
+_PKG_NAME_NORMALIZE = re.compile(r"[-_.]+")
+# File names given to offloaded outputs
+_OUTPUT_NAME_RE = re.compile(r"[0-9a-f]{32}\.(png|jpg|json)")
 
-# Request/Response Models
 
-class FileNode(BaseModel):
-    """Represents a file or directory in the project tree."""
-    name: str
-    content: str | None = None
-    isEditable: bool | None = True
-    children: list["FileNode"] | None = None
+def _normalize_pkg_name(name: str) -> str:
+    """Normalize a project name so pip's spelling and the user's spelling compare equal."""
+    return _PKG_NAME_NORMALIZE.sub("-", name).lower()
+
 
+# Request/Response Models
 
 class CreateSessionRequest(BaseModel):
     files: list[FileNode] | None = None  # Project file tree for imports and datasets
@@ -47,6 +61,7 @@ class ExecuteCellRequest(BaseModel):
     session_id: str
     code: str
     timeout: float = 60.0
+    offload_outputs: bool = False  # Return large images/plots as {"$ref": url} instead of inline
 
 
 class ExecuteCellResponse(BaseModel):
@@ -55,6 +70,17 @@ class ExecuteCellResponse(BaseModel):
     status: str
 
 
+class ExecuteBatchRequest(BaseModel):
+    session_id: str
+    codes: list[str]
+    timeout: float = 60.0  # Covers the whole batch
+    offload_outputs: bool = False
+
+
+class ExecuteBatchResponse(BaseModel):
+    results: list[ExecuteCellResponse]
+
+
 class SessionInfoResponse(BaseModel):
     session_id: str
     execution_count: int
@@ -80,12 +106,6 @@ class InstallPackageResponse(BaseModel):
     output: str
 
 
-class UpdateFileRequest(BaseModel):
-    session_id: str
-    file_path: str  # Relative path like "utils/helpers.py"
-    content: str
-
-
 # Endpoints
 
 @router.post("/sessions", response_model=CreateSessionResponse)
@@ -103,21 +123,22 @@ async def create_session(request: CreateSessionRequest | None = None):
     and the directory will be added to sys.path for imports.
     """
     try:
-        # Convert Pydantic models to dicts if files provided
+        # Walk the file tree lazily if files provided
         files_data = None
         requirements = None
 
         if request:
             requirements = request.requirements_txt
             if request.files:
-                files_data = [f.model_dump() for f in request.files]
-                print(f"[Notebook API] Received {len(request.files)} top-level files/folders")
-                for f in request.files:
-                    print(f"[Notebook API]   - {f.name} ({'dir' if f.children else 'file'})")
+                files_data = walk_files(request.files)
+                logger.info("[Notebook API] Received %d top-level files/folders", len(request.files))
+                if logger.isEnabledFor(logging.DEBUG):
+                    for f in request.files:
+                        logger.debug("[Notebook API]   - %s (%s)", f.name, "dir" if f.children else "file")
             else:
-                print("[Notebook API] No files received in request")
+                logger.debug("[Notebook API] No files received in request")
         else:
-            print("[Notebook API] Request is None")
+            logger.debug("[Notebook API] Request is None")
 
         session = await create_kernel_session(
             files=files_data,
@@ -126,15 +147,14 @@ async def create_session(request: CreateSessionRequest | None = None):
 
         message = "Kernel session created successfully"
         if files_data:
-            message += f" with project context ({len(files_data)} items)"
+            message += f" with project context ({len(request.files)} items)"
 
         return CreateSessionResponse(
             session_id=session.session_id,
             message=message
         )
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("[Notebook API] Failed to create kernel")
         raise HTTPException(status_code=500, detail=f"Failed to create kernel: {str(e)}")
 
 
@@ -145,7 +165,8 @@ async def execute(request: ExecuteCellRequest):
         result = await execute_cell(
             session_id=request.session_id,
             code=request.code,
-            timeout=request.timeout
+            timeout=request.timeout,
+            offload_outputs=request.offload_outputs
         )
         return ExecuteCellResponse(**result)
     except ValueError as e:
@@ -154,10 +175,32 @@ async def execute(request: ExecuteCellRequest):
         raise HTTPException(status_code=500, detail=f"Execution failed: {str(e)}")
 
 
+@router.post("/execute-batch", response_model=ExecuteBatchResponse)
+async def execute_batch(request: ExecuteBatchRequest):
+    """
+    Execute several code cells in order in a kernel session.
+
+    All cells are queued in the kernel at once, so they run back to back without a
+    request round-trip between them. Cells after one that raises are not run.
+    """
+    try:
+        results = await execute_cells(
+            session_id=request.session_id,
+            codes=request.codes,
+            timeout=request.timeout,
+            offload_outputs=request.offload_outputs
+        )
+        return ExecuteBatchResponse(results=[ExecuteCellResponse(**result) for result in results])
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Execution failed: {str(e)}")
+
+
 @router.get("/sessions", response_model=SessionListResponse)
 async def get_sessions():
     """List all active kernel sessions."""
-    sessions = list_sessions()
+    sessions = await list_sessions()
     return SessionListResponse(sessions=sessions)
 
 
@@ -170,6 +213,15 @@ async def get_session(session_id: str):
     return SessionInfoResponse(**info)
 
 
+@router.get("/sessions/{session_id}/outputs/{name}")
+async def get_output(session_id: str, name: str):
+    """Serve a cell output that an execute request offloaded to a file."""
+    path = get_output_path(session_id, name) if _OUTPUT_NAME_RE.fullmatch(name) else None
+    if not path:
+        raise HTTPException(status_code=404, detail="Output not found")
+    return FileResponse(path)
+
+
 @router.post("/sessions/{session_id}/interrupt")
 async def interrupt(session_id: str):
     """Interrupt a running kernel."""
@@ -202,8 +254,9 @@ async def install_packages(request: InstallPackageRequest):
     """
     Install Python packages via pip in the kernel session.
 
-    Uses `%pip install` magic command which installs packages into
-    the same environment as the running kernel.
+    Uses the `%pip install` magic, which runs pip with the kernel's own
+    interpreter. Sessions on a shared requirements environment install into a
+    private overlay directory so the shared environment stays unchanged.
     """
     if not request.packages:
         raise HTTPException(status_code=400, detail="No packages specified")
@@ -213,17 +266,16 @@ async def install_packages(request: InstallPackageRequest):
     for pkg in request.packages:
         # Only allow alphanumeric, hyphen, underscore, brackets, comparison operators
         pkg = pkg.strip()
-        if pkg and all(c.isalnum() or c in "-_[]<>=.,! " for c in pkg):
+        if pkg and _PKG_RE.fullmatch(pkg):
             sanitized.append(pkg)
 
     if not sanitized:
         raise HTTPException(status_code=400, detail="Invalid package names")
 
-    # Build pip install command using %pip magic (works in Jupyter kernels)
-    packages_str = " ".join(f'"{pkg}"' for pkg in sanitized)
-    code = f"!pip install {packages_str}"
-
     try:
+        # %pip runs pip with the kernel's own interpreter; sessions on a shared
+        # requirements env install into a private overlay instead (see pip_install_code)
+        code = pip_install_code(request.session_id, sanitized)
         result = await execute_cell(
             session_id=request.session_id,
             code=code,
@@ -231,36 +283,56 @@ async def install_packages(request: InstallPackageRequest):
         )
 
         # Parse output to determine success/failure
-        output_text = ""
+        chunks = []
         for output in result["outputs"]:
             if output.get("text"):
-                output_text += "".join(output["text"])
+                chunks.extend(output["text"])
             elif output.get("data", {}).get("text/plain"):
                 text = output["data"]["text/plain"]
-                output_text += "".join(text) if isinstance(text, list) else text
+                if isinstance(text, list):
+                    chunks.extend(text)
+                else:
+                    chunks.append(text)
+        output_text = "".join(chunks)
+
+        # Index pip's output in one pass instead of rescanning it per package
+        satisfied: set[str] = set()
+        error_lines: list[str] = []
+        for line in output_text.splitlines():
+            line = line.strip()
+            if line.startswith("Successfully installed "):
+                for dist in line[len("Successfully installed "):].split():
+                    satisfied.add(_normalize_pkg_name(dist.rsplit("-", 1)[0]))
+            elif line.startswith("Requirement already satisfied: "):
+                requirement = line[len("Requirement already satisfied: "):].split(" ", 1)[0]
+                satisfied.add(_normalize_pkg_name(_PKG_NAME_SPLIT.split(requirement, 1)[0]))
+            elif line.startswith("ERROR"):
+                error_lines.append(line.lower())
+        error_text = "\n".join(error_lines)
 
         # Check for success indicators
         installed = []
         failed = []
 
         for pkg in sanitized:
-            pkg_name = pkg.split("[")[0].split("<")[0].split(">")[0].split("=")[0].split("!")[0].strip()
-            if f"Successfully installed" in output_text and pkg_name.lower() in output_text.lower():
-                installed.append(pkg)
-            elif f"Requirement already satisfied: {pkg_name}" in output_text:
-                installed.append(pkg)  # Already installed counts as success
-            elif "ERROR" in output_text and pkg_name.lower() in output_text.lower():
+            pkg_name = _PKG_NAME_SPLIT.split(pkg, 1)[0].strip()
+            if _normalize_pkg_name(pkg_name) in satisfied:
+                installed.append(pkg)  # Newly installed or already installed
+            elif pkg_name.lower() in error_text:
                 failed.append(pkg)
             else:
                 # Assume success if no explicit error
                 installed.append(pkg)
 
-        return InstallPackageResponse(
-            success=len(failed) == 0,
-            installed=installed,
-            failed=failed,
-            output=output_text
-        )
+        # Return the payload directly: output can be megabytes of pip log, and a
+        # Response object skips model construction and response_model re-validation.
+        # response_model stays on the route for the OpenAPI schema.
+        return ORJSONResponse({
+            "success": len(failed) == 0,
+            "installed": installed,
+            "failed": failed,
+            "output": output_text,
+        })
 
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
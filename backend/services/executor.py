@@ -1,16 +1,38 @@
 import asyncio
-import json
+import atexit
+import concurrent.futures
+import hashlib
+import logging
 import os
+import random
+import re
 import shutil
+import signal
 import socket
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import traceback
 import uuid
 from asyncio import Queue
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
 from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 from typing import Any, Optional
 
+import orjson
+
+from services._fs import write_file, write_files_to_disk
+
+if sys.platform == "win32":
+    import psutil
+
+logger = logging.getLogger(__name__)
+
 
 class ProjectType(Enum):
     NEXTJS = "nextjs"
@@ -22,12 +44,59 @@ class ProjectType(Enum):
     UNKNOWN = "unknown"
 
 
+# Every way _classify_package_lock can find a framework needs one of these substrings
+_LOCKFILE_NEEDLES = (
+    "node_modules/next", "node_modules/react-scripts", "node_modules/vite",
+    '"next"', '"react-scripts"', '"vite"',
+)
+
+# Hardcoded ports in Node.js entry files. Patterns work on bytes and substitute with
+# templates, so patching never decodes the file or calls back into Python per match.
+# .listen(3000) / .listen(8080, ...)
+_LISTEN_PORT_RE = re.compile(rb"\.listen\s*\(\s*(\d{3,5})\s*([,\)])")
+# const/let/var + port/PORT + = + number + ; (with optional spaces)
+_PORT_DECL_RE = re.compile(rb"(const|let|var)\s+(port|PORT)\s*=\s*(\d{3,5})\s*;")
+
+_SEP = os.sep
+
+# Files whose presence marks a directory as the project root
+_PROJECT_ROOT_MARKERS = frozenset({"package.json", "package-lock.json", "requirements.txt"})
+
+# Maximum number of output chunks buffered per session; beyond it the oldest are dropped
+OUTPUT_QUEUE_SIZE = 1024
+# Bytes requested per read() of a subprocess pipe
+READ_CHUNK_SIZE = 64 * 1024
+
+# Reader threads live as long as their dev server, so they get their own pool
+# instead of occupying the loop's default executor used for short-lived work
+_SUBPROC_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=64, thread_name_prefix="subproc")
+
+
+# Dev server ports are drawn from the IANA dynamic range, skipping ports that
+# live sessions already hold (released in cleanup_session)
+PORT_RANGE = range(49152, 65536)
+_used_ports: set[int] = set()
+
+
 def get_free_port() -> int:
-    """Find a free port on the system."""
+    """Reserve a free port for a dev server."""
+    for _ in range(64):
+        port = random.choice(PORT_RANGE)
+        if port in _used_ports:
+            continue
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.bind(('', port))
+            except OSError:
+                continue
+        _used_ports.add(port)
+        return port
+
+    # Range looks exhausted: let the OS pick
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind(('', 0))
-        s.listen(1)
         port = s.getsockname()[1]
+    _used_ports.add(port)
     return port
 
 
@@ -35,83 +104,137 @@ def get_free_port() -> int:
 class ExecutionSession:
     session_id: str
     project_dir: str
-    process: Any = None  # subprocess.Popen process (sync)
-    output_queue: Queue = field(default_factory=Queue)
+    base_dir: str = ""  # Temp directory the files were extracted into (may contain project_dir)
+    real_project_dir: str = ""  # project_dir with symlinks resolved, for path containment checks
+    process: Any = None  # asyncio.subprocess.Process on POSIX, subprocess.Popen on Windows
+    output_queue: Queue = field(default_factory=lambda: Queue(maxsize=OUTPUT_QUEUE_SIZE))
     is_running: bool = False
     project_type: ProjectType = ProjectType.UNKNOWN
     port: int = 0  # Assigned port for the dev server
     should_stop: bool = False  # Flag to signal stop request
+    done_event: asyncio.Event = field(default_factory=asyncio.Event)  # Set once execution has fully finished
+    truncated_bytes: int = 0  # Output dropped from a full queue since the stream last reported it
+    last_activity: float = field(default_factory=time.monotonic)  # time.monotonic() of the last output or file update
 
 
 # Store active sessions
 active_sessions: dict[str, ExecutionSession] = {}
 
+# Sessions left idle (not running, no output) this long are evicted by the janitor
+SESSION_IDLE_TIMEOUT = 300.0
+JANITOR_INTERVAL = 60.0
+_janitor_task: asyncio.Task | None = None
 
-def detect_project_type(files: list[dict]) -> ProjectType:
-    """Detect project type from files."""
-    file_names = set()
-    package_json_content = None
-    package_lock_content = None
+# Recent manifest classifications keyed by content digest (LRU, see _memoized_classify)
+MANIFEST_CACHE_SIZE = 64
+_manifest_cache: OrderedDict[bytes, ProjectType | None] = OrderedDict()
 
-    def collect_files(nodes: list[dict], prefix: str = ""):
-        nonlocal package_json_content, package_lock_content
-        for node in nodes:
-            name = node.get("name", "")
-            full_path = f"{prefix}/{name}" if prefix else name
 
-            if node.get("children") is not None:
-                collect_files(node["children"], full_path)
-            else:
-                file_names.add(name)
-                if name == "package.json" and node.get("content"):
-                    package_json_content = node["content"]
-                elif name == "package-lock.json" and node.get("content"):
-                    package_lock_content = node["content"]
+def _classify_package_json(content: str) -> ProjectType | None:
+    """Classify a Node.js project from package.json, or None if it doesn't parse."""
+    try:
+        pkg = orjson.loads(content)
+        deps = {**pkg.get("dependencies", {}), **pkg.get("devDependencies", {})}
+
+        if "next" in deps:
+            return ProjectType.NEXTJS
+        if "react-scripts" in deps:
+            return ProjectType.REACT_CRA
+        if "vite" in deps:
+            return ProjectType.VITE
+        return ProjectType.NODEJS
+    except orjson.JSONDecodeError:
+        return None
+
+
+def _classify_package_lock(content: str) -> ProjectType | None:
+    """Classify a Node.js project from a fully parsed package-lock.json, or None if it doesn't parse."""
+    try:
+        lock = orjson.loads(content)
+        packages = lock.get("packages", {})
+        # Check root package or node_modules entries
+        root_deps = packages.get("", {}).get("dependencies", {})
+
+        if "next" in root_deps:
+            return ProjectType.NEXTJS
+        if "react-scripts" in root_deps:
+            return ProjectType.REACT_CRA
+        if "vite" in root_deps:
+            return ProjectType.VITE
+
+        # Also check if packages has these as keys
+        if any("node_modules/next" in k for k in packages.keys()):
+            return ProjectType.NEXTJS
+        if any("node_modules/react-scripts" in k for k in packages.keys()):
+            return ProjectType.REACT_CRA
+        if any("node_modules/vite" in k for k in packages.keys()):
+            return ProjectType.VITE
+
+        return ProjectType.NODEJS
+    except orjson.JSONDecodeError:
+        return None
+
+
+def _memoized_classify(
+    kind: bytes,
+    content: str,
+    classify: Callable[[str], ProjectType | None],
+) -> ProjectType | None:
+    """Run classify(content), memoized on a BLAKE2 digest of the content.
+
+    The edit -> run loop resubmits identical manifests, so repeat runs skip the parse.
+    """
+    key = hashlib.blake2b(content.encode("utf-8"), digest_size=16, person=kind).digest()
 
-    collect_files(files)
+    if key in _manifest_cache:
+        _manifest_cache.move_to_end(key)
+        return _manifest_cache[key]
+
+    project_type = classify(content)
+    _manifest_cache[key] = project_type
+    if len(_manifest_cache) > MANIFEST_CACHE_SIZE:
+        _manifest_cache.popitem(last=False)
+    return project_type
+
+
+def detect_project_type(files: list[tuple[str, str | None]]) -> ProjectType:
+    """Detect project type from (relative_path, content) file entries."""
+    package_json_content = None
+    package_lock_content = None
+
+    # Only the two npm manifests matter up front; stop as soon as both are found
+    for path, content in files:
+        if not content:
+            continue  # Directory entry or empty file
+        if package_json_content is None and (path == "package.json" or path.endswith("/package.json")):
+            package_json_content = content
+        elif package_lock_content is None and (
+            path == "package-lock.json" or path.endswith("/package-lock.json")
+        ):
+            package_lock_content = content
+        if package_json_content is not None and package_lock_content is not None:
+            break
 
     # Check for package.json and detect JS framework
     if package_json_content:
-        try:
-            pkg = json.loads(package_json_content)
-            deps = {**pkg.get("dependencies", {}), **pkg.get("devDependencies", {})}
-
-            if "next" in deps:
-                return ProjectType.NEXTJS
-            if "react-scripts" in deps:
-                return ProjectType.REACT_CRA
-            if "vite" in deps:
-                return ProjectType.VITE
-            return ProjectType.NODEJS
-        except json.JSONDecodeError:
-            pass
+        project_type = _memoized_classify(b"package.json", package_json_content, _classify_package_json)
+        if project_type is not None:
+            return project_type
 
     # Fallback: Check package-lock.json for dependencies
     if package_lock_content:
-        try:
-            lock = json.loads(package_lock_content)
-            packages = lock.get("packages", {})
-            # Check root package or node_modules entries
-            root_deps = packages.get("", {}).get("dependencies", {})
-
-            if "next" in root_deps:
-                return ProjectType.NEXTJS
-            if "react-scripts" in root_deps:
-                return ProjectType.REACT_CRA
-            if "vite" in root_deps:
-                return ProjectType.VITE
-
-            # Also check if packages has these as keys
-            if any("node_modules/next" in k for k in packages.keys()):
-                return ProjectType.NEXTJS
-            if any("node_modules/react-scripts" in k for k in packages.keys()):
-                return ProjectType.REACT_CRA
-            if any("node_modules/vite" in k for k in packages.keys()):
-                return ProjectType.VITE
-
+        # Without any needle the full parse could only conclude plain Node.js, so
+        # skip parsing what is often megabytes of JSON. Any needle means root
+        # dependencies may decide, so those lockfiles are parsed in full.
+        if not any(needle in package_lock_content for needle in _LOCKFILE_NEEDLES):
             return ProjectType.NODEJS
-        except json.JSONDecodeError:
-            pass
+
+        project_type = _memoized_classify(b"package-lock", package_lock_content, _classify_package_lock)
+        if project_type is not None:
+            return project_type
+
+    # Not a Node.js project: only now collect the plain file names
+    file_names = {path.rsplit("/", 1)[-1] for path, content in files if content is not None}
 
     # Check for Python
     if "requirements.txt" in file_names:
@@ -144,67 +267,79 @@ def get_run_commands(project_type: ProjectType, port: int, use_nodemon: bool = F
     return commands.get(project_type, (None, ""))
 
 
-def write_files_to_disk(files: list[dict], base_dir: str) -> None:
-    """Write file tree to disk."""
-    def write_node(node: dict, current_path: str):
-        name = node.get("name", "")
-        full_path = os.path.join(current_path, name)
-
-        if node.get("children") is not None:
-            # It's a directory
-            os.makedirs(full_path, exist_ok=True)
-            for child in node["children"]:
-                write_node(child, full_path)
-        else:
-            # It's a file
-            content = node.get("content", "")
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            with open(full_path, "w", encoding="utf-8") as f:
-                f.write(content)
-
-    for node in files:
-        write_node(node, base_dir)
+def find_project_root(base_dir: str, files: list[tuple[str, str | None]]) -> str:
+    """Find the actual project root (where package.json or main files are).
 
+    Decided from the (relative_path, content) entries just written under
+    base_dir, so it needs no filesystem calls.
+    """
+    top_level: dict[str, bool] = {}  # name -> is a directory
+    for path, content in files:
+        if "/" not in path:
+            top_level[path] = content is None
 
-def find_project_root(base_dir: str) -> str:
-    """Find the actual project root (where package.json or main files are)."""
     # Check if base_dir itself has package.json or is the project root
-    if os.path.exists(os.path.join(base_dir, "package.json")):
-        return base_dir
-    if os.path.exists(os.path.join(base_dir, "package-lock.json")):
-        return base_dir
-    if os.path.exists(os.path.join(base_dir, "requirements.txt")):
+    if not _PROJECT_ROOT_MARKERS.isdisjoint(top_level):
         return base_dir
 
     # Check if there's a single subdirectory that contains the project
-    entries = os.listdir(base_dir)
-    if len(entries) == 1:
-        subdir = os.path.join(base_dir, entries[0])
-        if os.path.isdir(subdir):
-            # Check if this subdir is the project root
-            if os.path.exists(os.path.join(subdir, "package.json")):
-                return subdir
-            if os.path.exists(os.path.join(subdir, "package-lock.json")):
-                return subdir
-            if os.path.exists(os.path.join(subdir, "requirements.txt")):
-                return subdir
-            # Check for src folder (common React/Node structure)
-            if os.path.exists(os.path.join(subdir, "src")):
-                return subdir
+    if len(top_level) == 1:
+        (name, is_dir), = top_level.items()
+        if is_dir:
+            prefix = f"{name}/"
+            sub_names = {
+                path[len(prefix):] for path, _ in files
+                if path.startswith(prefix) and "/" not in path[len(prefix):]
+            }
+            # Check if this subdir is the project root, or has a src folder
+            # (common React/Node structure)
+            if not _PROJECT_ROOT_MARKERS.isdisjoint(sub_names) or "src" in sub_names:
+                return f"{base_dir}{_SEP}{name}"
 
     return base_dir
 
 
-async def create_session(files: list[dict]) -> ExecutionSession:
-    """Create a new execution session."""
+def _enqueue_output(session: ExecutionSession, output: str | None) -> None:
+    """Queue output for the stream without ever blocking the producer.
+
+    If the consumer has fallen OUTPUT_QUEUE_SIZE items behind, the oldest
+    items are dropped and counted in session.truncated_bytes, so a runaway
+    dev server cannot grow memory without bound.
+    """
+    session.last_activity = time.monotonic()
+    queue = session.output_queue
+    while True:
+        try:
+            queue.put_nowait(output)
+            return
+        except asyncio.QueueFull:
+            dropped = queue.get_nowait()
+            if dropped is not None:
+                session.truncated_bytes += len(dropped.encode("utf-8", errors="replace"))
+
+
+def pop_truncation_marker(session: ExecutionSession) -> str | None:
+    """Describe output dropped since the last call, or None if nothing was dropped."""
+    if not session.truncated_bytes:
+        return None
+    marker = f"\n[... truncated {session.truncated_bytes} bytes ...]\n"
+    session.truncated_bytes = 0
+    return marker
+
+
+async def create_session(files: Iterable[tuple[str, str | None]]) -> ExecutionSession:
+    """Create a new execution session from (relative_path, content) file entries."""
     session_id = str(uuid.uuid4())
     temp_dir = tempfile.mkdtemp(prefix=f"workstation_{session_id[:8]}_")
 
-    # Write files to temp directory
-    write_files_to_disk(files, temp_dir)
+    # Entries are read twice (write + detection), so materialize the walk once
+    files = list(files)
+
+    # Write files to temp directory without blocking the event loop
+    await asyncio.to_thread(write_files_to_disk, files, temp_dir)
 
     # Find actual project root (handles nested folder structures)
-    project_dir = find_project_root(temp_dir)
+    project_dir = find_project_root(temp_dir, files)
 
     # Detect project type
     project_type = detect_project_type(files)
@@ -215,23 +350,40 @@ async def create_session(files: list[dict]) -> ExecutionSession:
     session = ExecutionSession(
         session_id=session_id,
         project_dir=project_dir,
+        base_dir=temp_dir,
+        real_project_dir=os.path.realpath(project_dir),
         project_type=project_type,
         port=port,
     )
 
     active_sessions[session_id] = session
+    _ensure_janitor()
 
     # Add initial message to queue so stream has something to read
-    await session.output_queue.put(f"Session created. Project dir: {project_dir}\n")
-    await session.output_queue.put(f"Assigned port: {port}\n")
+    _enqueue_output(session, f"Session created. Project dir: {project_dir}\n")
+    _enqueue_output(session, f"Assigned port: {port}\n")
 
     return session
 
 
-def _run_subprocess_sync(command: str, cwd: str, output_callback, session: "ExecutionSession") -> int:
-    """Run subprocess synchronously (called from thread pool)."""
-    import subprocess
+def _take_complete_lines(pending: bytearray) -> str | None:
+    """Remove and decode the complete lines at the front of pending.
+
+    A trailing partial line is held back for the next read unless it has
+    grown to READ_CHUNK_SIZE, so the buffer stays bounded.
+    """
+    end = pending.rfind(b"\n") + 1
+    if not end and len(pending) >= READ_CHUNK_SIZE:
+        end = len(pending)
+    if not end:
+        return None
+    text = pending[:end].decode("utf-8", errors="replace")
+    del pending[:end]
+    return text
 
+
+def _run_subprocess_sync(command: str, cwd: str, output_callback, session: "ExecutionSession") -> int:
+    """Run subprocess synchronously (called from thread pool, Windows only)."""
     try:
         process = subprocess.Popen(
             command,
@@ -240,23 +392,27 @@ def _run_subprocess_sync(command: str, cwd: str, output_callback, session: "Exec
             stderr=subprocess.STDOUT,
             cwd=cwd,
             env={**os.environ, "FORCE_COLOR": "1", "CI": "true"},
-            bufsize=1,
-            universal_newlines=False,
         )
 
         # Store process reference in session for stop functionality
         session.process = process
 
-        # Read output line by line
+        # Read output in large chunks and split lines in user space: one read()
+        # per chunk instead of one per line, and one callback per chunk of
+        # complete lines instead of one per line
         if process.stdout:
-            for line in iter(process.stdout.readline, b''):
-                if not line:
-                    break
-                # Check if stop was requested
-                if session.should_stop:
+            fd = process.stdout.fileno()
+            pending = bytearray()
+            while not session.should_stop:
+                chunk = os.read(fd, READ_CHUNK_SIZE)
+                if not chunk:
                     break
-                decoded = line.decode("utf-8", errors="replace")
-                output_callback(decoded)
+                pending += chunk
+                text = _take_complete_lines(pending)
+                if text:
+                    output_callback(text)
+            if pending and not session.should_stop:
+                output_callback(pending.decode("utf-8", errors="replace"))
             process.stdout.close()
 
         process.wait()
@@ -269,6 +425,76 @@ def _run_subprocess_sync(command: str, cwd: str, output_callback, session: "Exec
         session.process = None
 
 
+async def _run_subprocess_async(command: str, cwd: str, session: "ExecutionSession") -> int:
+    """Run subprocess on the event loop, reading its pipe without a helper thread."""
+    try:
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=cwd,
+            env={**os.environ, "FORCE_COLOR": "1", "CI": "true"},
+            # Own process group, so stop_session can signal the whole tree
+            start_new_session=True,
+        )
+    except Exception as e:
+        _enqueue_output(session, f"\n✗ Subprocess error: {str(e)}\n")
+        return -1
+
+    # Store process reference in session for stop functionality
+    session.process = process
+    try:
+        pending = bytearray()
+        while not session.should_stop:
+            chunk = await process.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            pending += chunk
+            text = _take_complete_lines(pending)
+            if text:
+                _enqueue_output(session, text)
+        if pending and not session.should_stop:
+            _enqueue_output(session, pending.decode("utf-8", errors="replace"))
+
+        return await process.wait() or 0
+    finally:
+        session.process = None
+
+
+class _OutputBatcher:
+    """Coalesces output from a reader thread into as few queue puts as possible.
+
+    The reader appends under a lock. Only the first append after the buffer
+    was emptied schedules a flush on the loop; everything written while that
+    flush is pending is joined into the same queue item.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, session: "ExecutionSession"):
+        self._loop = loop
+        self._session = session
+        self._lock = threading.Lock()
+        self._parts: list[str] = []
+        self._scheduled = False
+
+    def write(self, text: str) -> None:
+        """Buffer text for the queue (called from the reader thread)."""
+        with self._lock:
+            self._parts.append(text)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._loop.call_soon_threadsafe(self.flush)
+
+    def flush(self) -> None:
+        """Move buffered text into the queue (called on the loop)."""
+        with self._lock:
+            text = "".join(self._parts)
+            self._parts.clear()
+            self._scheduled = False
+        if text:
+            _enqueue_output(self._session, text)
+
+
 async def run_command(session: ExecutionSession, command: str, signal_end: bool = True) -> int:
     """Run a command and stream output to the session queue.
 
@@ -277,87 +503,95 @@ async def run_command(session: ExecutionSession, command: str, signal_end: bool
     exit_code = -1
     try:
         session.is_running = True
-        await session.output_queue.put(f"$ {command}\n")
-
-        loop = asyncio.get_event_loop()
-
-        # Callback to put output into the async queue
-        def output_callback(text: str):
-            # Schedule the coroutine on the event loop from the thread
-            asyncio.run_coroutine_threadsafe(
-                session.output_queue.put(text),
-                loop
-            )
-
-        # Run subprocess in thread pool to avoid Windows asyncio subprocess issues
-        exit_code = await loop.run_in_executor(
-            None,
-            _run_subprocess_sync,
-            command,
-            session.project_dir,
-            output_callback,
-            session
-        )
+        _enqueue_output(session, f"$ {command}\n")
+
+        if sys.platform == "win32":
+            loop = asyncio.get_event_loop()
+
+            # Batch output from the reader thread so a burst of chunks costs one
+            # coroutine hop on the loop instead of one per chunk
+            batcher = _OutputBatcher(loop, session)
+
+            # Run subprocess in thread pool to avoid Windows asyncio subprocess issues
+            try:
+                exit_code = await loop.run_in_executor(
+                    _SUBPROC_POOL,
+                    _run_subprocess_sync,
+                    command,
+                    session.project_dir,
+                    batcher.write,
+                    session
+                )
+            finally:
+                # Queue any text still buffered ahead of the exit status
+                batcher.flush()
+        else:
+            exit_code = await _run_subprocess_async(command, session.project_dir, session)
 
         if exit_code == 0:
-            await session.output_queue.put(f"\n✓ Process exited with code {exit_code}\n")
+            _enqueue_output(session, f"\n✓ Process exited with code {exit_code}\n")
         else:
-            await session.output_queue.put(f"\n✗ Process exited with code {exit_code}\n")
+            _enqueue_output(session, f"\n✗ Process exited with code {exit_code}\n")
 
     except asyncio.CancelledError:
-        await session.output_queue.put("\n⚠ Process cancelled\n")
+        _enqueue_output(session, "\n⚠ Process cancelled\n")
     except Exception as e:
-        import traceback
         error_details = traceback.format_exc()
-        await session.output_queue.put(f"\n✗ Error: {type(e).__name__}: {str(e)}\n")
-        await session.output_queue.put(f"Details: {error_details}\n")
+        _enqueue_output(session, f"\n✗ Error: {type(e).__name__}: {str(e)}\n")
+        _enqueue_output(session, f"Details: {error_details}\n")
     finally:
         session.is_running = False
         if signal_end:
-            await session.output_queue.put(None)  # Signal end of output
+            _enqueue_output(session, None)  # Signal end of output
 
     return exit_code
 
 
+def _list_file_names(directory: str) -> set[str]:
+    """Names of the regular files directly inside directory (empty if it is missing)."""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except OSError:
+        return set()
+
+
 def patch_nodejs_port(project_dir: str, port: int) -> list[str]:
     """Patch Node.js files to use the dynamic port instead of hardcoded ports.
 
     Returns list of patched files.
     """
-    import re
     patched_files = []
 
     # Common entry point files for Node.js
     entry_files = ["server.js", "app.js", "index.js", "main.js", "src/server.js", "src/app.js", "src/index.js"]
 
+    # One directory listing per folder instead of a stat per candidate
+    present = _list_file_names(project_dir)
+    present |= {f"src/{name}" for name in _list_file_names(os.path.join(project_dir, "src"))}
+
     for entry_file in entry_files:
         file_path = os.path.join(project_dir, entry_file)
-        if os.path.exists(file_path):
+        if entry_file in present:
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
+                with open(file_path, "rb") as f:
                     content = f.read()
 
+                # Neither pattern can match without one of these, so skip the regex scans
+                if b".listen" not in content and b"port" not in content and b"PORT" not in content:
+                    continue
+
                 original_content = content
 
                 # Pattern 1: .listen(3000) or .listen(8080) etc - hardcoded port numbers in listen()
                 # Replace with process.env.PORT || original_port
-                content = re.sub(
-                    r'\.listen\s*\(\s*(\d{3,5})\s*([,\)])',
-                    lambda m: f'.listen(process.env.PORT || {m.group(1)}{m.group(2)}',
-                    content
-                )
+                content = _LISTEN_PORT_RE.sub(rb".listen(process.env.PORT || \1\2", content)
 
                 # Pattern 2: const PORT = 3000 or let port = 8080 etc (variable assignment)
-                # Match: const/let/var + port/PORT + = + number + ; (with optional spaces)
-                content = re.sub(
-                    r'(const|let|var)\s+(port|PORT)\s*=\s*(\d{3,5})\s*;',
-                    lambda m: f'{m.group(1)} {m.group(2)} = process.env.PORT || {m.group(3)};',
-                    content
-                )
+                content = _PORT_DECL_RE.sub(rb"\1 \2 = process.env.PORT || \3;", content)
 
                 if content != original_content:
-                    with open(file_path, "w", encoding="utf-8") as f:
-                        f.write(content)
+                    write_file(file_path, content)
                     patched_files.append(entry_file)
 
             except Exception:
@@ -368,16 +602,25 @@ def patch_nodejs_port(project_dir: str, port: int) -> list[str]:
 
 async def execute_project(session: ExecutionSession) -> None:
     """Execute the project based on its type."""
+    try:
+        await _execute_project_steps(session)
+    finally:
+        # Wake any stream waiting on the session, even if a step raised
+        session.done_event.set()
+
+
+async def _execute_project_steps(session: ExecutionSession) -> None:
+    """Install dependencies and run the project, pushing output to the session queue."""
     project_type = session.project_type
 
     if project_type == ProjectType.UNKNOWN:
-        await session.output_queue.put("✗ Unknown project type. Cannot run.\n")
-        await session.output_queue.put(None)
+        _enqueue_output(session, "✗ Unknown project type. Cannot run.\n")
+        _enqueue_output(session, None)
         return
 
     if project_type == ProjectType.SIMPLE_WEB:
-        await session.output_queue.put("✓ Simple web project detected. Use browser preview.\n")
-        await session.output_queue.put(None)
+        _enqueue_output(session, "✓ Simple web project detected. Use browser preview.\n")
+        _enqueue_output(session, None)
         return
 
     # For Node.js, use nodemon for hot reload
@@ -385,15 +628,15 @@ async def execute_project(session: ExecutionSession) -> None:
 
     install_cmd, run_cmd = get_run_commands(project_type, session.port, use_nodemon=use_nodemon)
 
-    await session.output_queue.put(f"Detected project type: {project_type.value}\n")
-    await session.output_queue.put(f"Dev server will run on port: {session.port}\n\n")
+    _enqueue_output(session, f"Detected project type: {project_type.value}\n")
+    _enqueue_output(session, f"Dev server will run on port: {session.port}\n\n")
 
     # For Node.js projects, patch hardcoded ports and find entry file
     main_js_file = "server.js"  # Default
     if project_type == ProjectType.NODEJS:
         patched = patch_nodejs_port(session.project_dir, session.port)
         if patched:
-            await session.output_queue.put(f"⚙ Patched port in: {', '.join(patched)}\n\n")
+            _enqueue_output(session, f"⚙ Patched port in: {', '.join(patched)}\n\n")
             # Use the first patched file as entry point
             main_js_file = patched[0]
         else:
@@ -405,7 +648,7 @@ async def execute_project(session: ExecutionSession) -> None:
 
         # Update run command with correct entry file
         run_cmd = f"set PORT={session.port} && npx nodemon {main_js_file}"
-        await session.output_queue.put(f"⚙ Using nodemon for hot reload (entry: {main_js_file})\n\n")
+        _enqueue_output(session, f"⚙ Using nodemon for hot reload (entry: {main_js_file})\n\n")
 
     # Run install command if needed
     if install_cmd:
@@ -416,12 +659,12 @@ async def execute_project(session: ExecutionSession) -> None:
         if not os.path.exists(node_modules):
             # Check if package.json exists - npm install requires it
             if not os.path.exists(package_json):
-                await session.output_queue.put("⚠ No package.json found. Skipping npm install.\n")
+                _enqueue_output(session, "⚠ No package.json found. Skipping npm install.\n")
             else:
                 exit_code = await run_command(session, install_cmd, signal_end=False)
                 # Check if install failed
                 if exit_code != 0:
-                    await session.output_queue.put(None)
+                    _enqueue_output(session, None)
                     return
 
     # Check for requirements.txt for Python
@@ -431,7 +674,7 @@ async def execute_project(session: ExecutionSession) -> None:
             exit_code = await run_command(session, "pip install -r requirements.txt", signal_end=False)
             if exit_code != 0:
                 # Try installing without version pins (fallback for old dependencies)
-                await session.output_queue.put("\n⚠ Pinned versions failed. Trying without version constraints...\n\n")
+                _enqueue_output(session, "\n⚠ Pinned versions failed. Trying without version constraints...\n\n")
 
                 # Read requirements and strip version pins
                 with open(req_file, "r") as f:
@@ -449,10 +692,10 @@ async def execute_project(session: ExecutionSession) -> None:
                     packages_str = " ".join(packages)
                     exit_code = await run_command(session, f"pip install {packages_str}", signal_end=False)
                     if exit_code != 0:
-                        await session.output_queue.put(None)
+                        _enqueue_output(session, None)
                         return
                 else:
-                    await session.output_queue.put(None)
+                    _enqueue_output(session, None)
                     return
 
         # Check what type of Python web framework it is
@@ -485,10 +728,41 @@ async def execute_project(session: ExecutionSession) -> None:
     await run_command(session, run_cmd, signal_end=True)
 
 
+def _kill_process_tree(pid: int, port: int) -> None:
+    """Terminate pid, its descendants and any other process listening on port (Windows)."""
+    try:
+        parent = psutil.Process(pid)
+        procs = parent.children(recursive=True) + [parent]
+    except psutil.NoSuchProcess:
+        procs = []
+
+    # Also catch processes on our port that escaped the tree,
+    # such as orphaned uvicorn reload workers
+    try:
+        known = {proc.pid for proc in procs}
+        for conn in psutil.net_connections(kind="inet"):
+            if conn.laddr and conn.laddr.port == port and conn.pid and conn.pid not in known:
+                logger.info("[Stop] Killing orphaned process on port: %s", conn.pid)
+                procs.append(psutil.Process(conn.pid))
+                known.add(conn.pid)
+    except (psutil.Error, OSError) as e:
+        logger.warning("[Stop] Error finding port processes: %s", e)
+
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(procs, timeout=1.0)
+    for proc in alive:
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
 async def stop_session(session_id: str) -> bool:
     """Stop a running session."""
-    import subprocess
-
     session = active_sessions.get(session_id)
     if not session:
         return False
@@ -498,51 +772,28 @@ async def stop_session(session_id: str) -> bool:
 
     if session.process and session.is_running:
         try:
-            import sys
             pid = session.process.pid
-            print(f"[Stop] Attempting to kill process {pid}")
+            logger.info("[Stop] Attempting to kill process %s", pid)
 
             if sys.platform == "win32":
-                # On Windows, use taskkill to kill the entire process tree
-                # This handles uvicorn's child processes
-                result = subprocess.run(
-                    ["taskkill", "/F", "/T", "/PID", str(pid)],
-                    capture_output=True,
-                    text=True
-                )
-                print(f"[Stop] taskkill result: {result.returncode}, stdout: {result.stdout}, stderr: {result.stderr}")
-
-                # Also try to kill any processes listening on our port
-                # This catches uvicorn reload workers that might be orphaned
-                try:
-                    # Find processes using the port
-                    netstat_result = subprocess.run(
-                        f'netstat -ano | findstr ":{session.port}"',
-                        shell=True,
-                        capture_output=True,
-                        text=True
-                    )
-                    if netstat_result.stdout:
-                        for line in netstat_result.stdout.strip().split('\n'):
-                            parts = line.split()
-                            if len(parts) >= 5:
-                                port_pid = parts[-1]
-                                if port_pid.isdigit() and port_pid != str(pid):
-                                    print(f"[Stop] Killing orphaned process on port: {port_pid}")
-                                    subprocess.run(
-                                        ["taskkill", "/F", "/PID", port_pid],
-                                        capture_output=True
-                                    )
-                except Exception as e:
-                    print(f"[Stop] Error cleaning up port processes: {e}")
+                # On Windows, terminate the whole process tree in-process instead
+                # of shelling out to taskkill and netstat
+                await asyncio.to_thread(_kill_process_tree, pid, session.port)
             else:
-                # On Unix, send SIGTERM then SIGKILL
-                session.process.terminate()
-                await asyncio.sleep(0.5)
-                if session.process.poll() is None:
-                    session.process.kill()
+                # On Unix, SIGTERM then SIGKILL the process group, so dev
+                # servers started by the shell die with it and release the pipe
+                process = session.process
+                os.killpg(pid, signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(process.wait(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
         except Exception as e:
-            print(f"[Stop] Error terminating process: {e}")
+            logger.warning("[Stop] Error terminating process: %s", e)
 
     # Mark session as not running
     session.is_running = False
@@ -554,8 +805,33 @@ async def cleanup_session(session_id: str) -> None:
     """Clean up session resources."""
     session = active_sessions.pop(session_id, None)
     if session:
-        # Clean up temp directory
-        try:
-            shutil.rmtree(session.project_dir, ignore_errors=True)
-        except Exception:
-            pass
+        _used_ports.discard(session.port)
+        # Clean up temp directory without blocking the event loop
+        await asyncio.to_thread(shutil.rmtree, session.base_dir or session.project_dir, ignore_errors=True)
+
+
+def _ensure_janitor() -> None:
+    """Start the idle-session janitor on the running loop if it is not already running."""
+    global _janitor_task
+    if _janitor_task is None or _janitor_task.done():
+        _janitor_task = asyncio.get_running_loop().create_task(_evict_idle_sessions())
+
+
+async def _evict_idle_sessions() -> None:
+    """Periodically clean up sessions whose stream was abandoned without a cleanup call."""
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL)
+        cutoff = time.monotonic() - SESSION_IDLE_TIMEOUT
+        idle = [
+            session_id for session_id, session in active_sessions.items()
+            if not session.is_running and session.last_activity < cutoff
+        ]
+        for session_id in idle:
+            await cleanup_session(session_id)
+
+
+@atexit.register
+def _remove_session_dirs() -> None:
+    """Remove the temp directories of sessions still open at interpreter exit."""
+    for session in active_sessions.values():
+        shutil.rmtree(session.base_dir or session.project_dir, ignore_errors=True)
@@ -10,137 +10,431 @@ imports from project files and access to datasets.
 """
 
 import asyncio
+import base64
+import hashlib
+import heapq
+import logging
 import os
 import shutil
+import site
+import stat
+import sys
 import tempfile
+import time
 import uuid
+import venv
+from collections.abc import Iterable
 from dataclasses import dataclass, field
 from typing import Any
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from jupyter_client import KernelManager
+import orjson
+from jupyter_client import AsyncKernelManager
 from jupyter_client.asynchronous import AsyncKernelClient
+from jupyter_client.kernelspec import KernelSpecManager
+
+from services._fs import write_file, write_files_to_disk
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
 class KernelSession:
     """Represents an active Jupyter kernel session."""
     session_id: str
-    kernel_manager: KernelManager
+    kernel_manager: AsyncKernelManager
     kernel_client: AsyncKernelClient
     project_dir: str | None = None  # Temp directory for project files
+    env_dir: str | None = None  # Shared requirements virtualenv the kernel runs in
+    site_overlay: str | None = None  # Private target for /install when env_dir is set
+    python_executable: str | None = None  # Kernel's sys.executable, once discovered
+    pending_init_code: str | None = None  # Project setup sent ahead of the next cell
+    outputs_dir: str | None = None  # Temp directory for offloaded outputs, made on first use
     execution_count: int = 0
     created_at: datetime = field(default_factory=datetime.now)
-    last_activity: datetime = field(default_factory=datetime.now)
+    # time.monotonic() of the latest activity, which is also its _idle_heap key. The
+    # wall-clock time is only derived when a session is listed.
+    last_activity_mono: float = field(default_factory=time.monotonic)
+    # Held while a request reads the kernel's IOPub channel. Concurrent readers would
+    # each discard the other's messages and wait for output that never comes.
+    exec_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
 
 
 # Active kernel sessions
 kernel_sessions: dict[str, KernelSession] = {}
 
+# Min-heap of (last_activity_mono, session_id). Every touch pushes a new entry instead
+# of updating the old one; entries whose stamp no longer matches are skipped
+_idle_heap: list[tuple[float, str]] = []
+
+
+def _touch_session(session: KernelSession) -> None:
+    """Record activity on a session for idle tracking."""
+    session.last_activity_mono = time.monotonic()
+    heapq.heappush(_idle_heap, (session.last_activity_mono, session.session_id))
+
+    # Superseded entries pile up on busy sessions; rebuild once they dominate
+    if len(_idle_heap) > 2 * len(kernel_sessions) + 64:
+        _idle_heap[:] = [(s.last_activity_mono, s.session_id) for s in kernel_sessions.values()]
+        heapq.heapify(_idle_heap)
+
+
+# Characters of stdout/stderr kept per cell; the rest is replaced by a marker
+MAX_STREAM_CHARS = 1024 * 1024
+
+# Rich outputs that execute requests may move to files (see _offload_outputs), with
+# the extension they are stored under. Images arrive base64-encoded.
+OFFLOAD_MIME_TYPES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "application/vnd.plotly.v1+json": ".json",
+}
+# Smaller payloads stay inline; a second request would cost more than they do
+OFFLOAD_MIN_SIZE = 64 * 1024
+
+# Started, ready kernels waiting to be handed to new sessions
+WARM_POOL_SIZE = 2
+_warm_pool: asyncio.Queue | None = None
+_warm_spawns: set[asyncio.Task] = set()
+
+# Virtualenvs keyed by a fingerprint of their requirements, so sessions asking for the
+# same packages share one install. Each env layers the server's own site-packages
+# (ipykernel included) beneath its own through a .pth file, and carries a kernel spec.
+# Envs are reused across server runs and their interpreters launched as kernels, so
+# they live in a private per-user directory rather than the shared temp dir.
+ENV_ROOT = os.environ.get("NOTEBOOK_ENV_ROOT") or os.path.join(os.path.expanduser("~"), ".cache", "notebook_envs")
+ENV_KERNEL_NAME = "notebook-env"
+_env_cache: dict[str, str] = {}  # fingerprint -> env directory with a completed install
+_env_locks: dict[str, asyncio.Lock] = {}
+# Envs unused for this long are deleted, checked at most once per ENV_SWEEP_INTERVAL.
+# Use refreshes the .installed marker's mtime.
+ENV_MAX_AGE = 14 * 24 * 3600
+ENV_SWEEP_INTERVAL = 3600
+_last_env_sweep = float("-inf")
+
+
+async def _start_kernel(env_dir: str | None = None) -> tuple[AsyncKernelManager, AsyncKernelClient]:
+    """Start a python3 kernel (in env_dir's virtualenv, if given) and wait until it answers."""
+    if env_dir:
+        km = AsyncKernelManager(
+            kernel_name=ENV_KERNEL_NAME,
+            kernel_spec_manager=KernelSpecManager(kernel_dirs=[_env_kernels_dir(env_dir)]),
+        )
+    else:
+        km = AsyncKernelManager(kernel_name='python3')
+    await km.start_kernel()
+
+    kc = km.client()
+    kc.start_channels()
+
+    # Wait for kernel to be ready
+    try:
+        await asyncio.wait_for(
+            kc.wait_for_ready(),
+            timeout=30.0
+        )
+    except asyncio.TimeoutError:
+        kc.stop_channels()
+        await km.shutdown_kernel()
+        raise RuntimeError("Kernel startup timed out")
+
+    return km, kc
+
+
+async def _spawn_warm_kernel() -> None:
+    """Start one kernel into the warm pool."""
+    try:
+        kernel = await _start_kernel()
+    except Exception as e:
+        logger.warning("[Notebook] Failed to pre-start kernel: %s", e)
+        return
+    _warm_pool.put_nowait(kernel)
+
+
+def _top_up_warm_pool() -> None:
+    """Start enough kernels in the background to bring the pool back to WARM_POOL_SIZE."""
+    for _ in range(WARM_POOL_SIZE - _warm_pool.qsize() - len(_warm_spawns)):
+        task = asyncio.create_task(_spawn_warm_kernel())
+        _warm_spawns.add(task)
+        task.add_done_callback(_warm_spawns.discard)
 
-def write_files_to_disk(files: list[dict], base_dir: str) -> None:
-    """Write file tree to disk, preserving directory structure."""
-    files_written = []
 
-    def write_node(node: dict, current_path: str):
-        name = node.get("name", "")
-        full_path = os.path.join(current_path, name)
+async def _take_warm_kernel() -> tuple[AsyncKernelManager, AsyncKernelClient] | None:
+    """Take a kernel from the warm pool, waiting for a pre-start already in flight
+    rather than racing it with a cold start. None if neither is available.
+    """
+    try:
+        return _warm_pool.get_nowait()
+    except asyncio.QueueEmpty:
+        pass
+
+    getter = asyncio.ensure_future(_warm_pool.get())
+    try:
+        # A failed pre-start leaves the pool empty, so also wake when a spawn ends
+        while _warm_spawns and not getter.done():
+            await asyncio.wait({getter, *_warm_spawns}, return_when=asyncio.FIRST_COMPLETED)
+        return getter.result() if getter.done() else None
+    finally:
+        getter.cancel()
+
+
+async def _acquire_kernel() -> tuple[AsyncKernelManager, AsyncKernelClient]:
+    """Take a ready kernel from the warm pool, or start one if the pool is empty.
+
+    The pool is refilled only after a kernel has been handed out, so background
+    starts never compete with a cold start the caller is waiting on.
+    """
+    global _warm_pool
+    if _warm_pool is None:
+        _warm_pool = asyncio.Queue()
+
+    try:
+        while True:
+            kernel = await _take_warm_kernel()
+            if kernel is None:
+                return await _start_kernel()
+            km, kc = kernel
+            if await km.is_alive():
+                return kernel
+            # Kernel died while waiting in the pool
+            kc.stop_channels()
+            await km.shutdown_kernel(now=True)
+    finally:
+        _top_up_warm_pool()
+
+
+def _env_kernels_dir(env_dir: str) -> str:
+    return os.path.join(env_dir, "share", "jupyter", "kernels")
+
+
+def _env_python(env_dir: str) -> str:
+    if sys.platform == "win32":
+        return os.path.join(env_dir, "Scripts", "python.exe")
+    return os.path.join(env_dir, "bin", "python")
+
+
+def _env_kernel_json(env_dir: str) -> str:
+    return os.path.join(_env_kernels_dir(env_dir), ENV_KERNEL_NAME, "kernel.json")
+
+
+def _build_env(env_dir: str) -> None:
+    """Create a virtualenv with a kernel spec that runs it (runs in a worker thread).
+
+    kernel.json is written last, so its presence means the build completed.
+    """
+    venv.EnvBuilder(with_pip=False).create(env_dir)
+
+    if sys.platform == "win32":
+        site_dir = os.path.join(env_dir, "Lib", "site-packages")
+    else:
+        site_dir = os.path.join(env_dir, "lib", f"python{sys.version_info[0]}.{sys.version_info[1]}", "site-packages")
+    with open(os.path.join(site_dir, "_notebook_base.pth"), "w", encoding="utf-8") as f:
+        f.write("\n".join(site.getsitepackages()) + "\n")
+
+    kernel_json = _env_kernel_json(env_dir)
+    os.makedirs(os.path.dirname(kernel_json), exist_ok=True)
+    with open(kernel_json, "wb") as f:
+        f.write(orjson.dumps({
+            "argv": [_env_python(env_dir), "-m", "ipykernel_launcher", "-f", "{connection_file}"],
+            "display_name": "Python 3 (notebook env)",
+            "language": "python",
+        }))
 
-        if node.get("children") is not None:
-            # It's a directory
-            os.makedirs(full_path, exist_ok=True)
-            print(f"[Notebook] Created directory: {full_path}")
-            for child in node["children"]:
-                write_node(child, full_path)
+
+def _private_dir(path: str) -> bool:
+    """Create path with mode 0700, or check that an existing one is private and ours.
+
+    Anything found in a directory other users can write to may have been planted.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if sys.platform == "win32":
+        return True  # Access is governed by ACLs; the profile directory is per-user
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def _evict_stale_envs(in_use: set[str]) -> None:
+    """Delete envs not used for ENV_MAX_AGE (runs in a worker thread)."""
+    cutoff = time.time() - ENV_MAX_AGE
+    with os.scandir(ENV_ROOT) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) or entry.path in in_use:
+                continue
+            try:
+                # Envs that never finished installing have no marker; age them by directory
+                try:
+                    mtime = os.stat(os.path.join(entry.path, ".installed")).st_mtime
+                except FileNotFoundError:
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            if mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                _env_cache.pop(entry.name, None)
+                logger.info("[Notebook] Removed unused environment %s", entry.name)
+
+
+async def _requirements_env(packages: list[str]) -> str | None:
+    """Return a virtualenv directory with packages installed, building it on first use.
+
+    Returns None if the env could not be built; the caller then installs into a
+    regular kernel instead.
+    """
+    if not _private_dir(ENV_ROOT):
+        logger.warning("[Notebook] Not using %s for environments: not a private directory owned by this user", ENV_ROOT)
+        return None
+
+    global _last_env_sweep
+    if time.monotonic() - _last_env_sweep > ENV_SWEEP_INTERVAL:
+        _last_env_sweep = time.monotonic()
+        in_use = {s.env_dir for s in kernel_sessions.values() if s.env_dir}
+        await asyncio.to_thread(_evict_stale_envs, in_use)
+
+    fingerprint = hashlib.sha256("\n".join(sorted(packages)).encode("utf-8")).hexdigest()[:16]
+    env_dir = os.path.join(ENV_ROOT, fingerprint)
+    marker = os.path.join(env_dir, ".installed")
+
+    async with _env_locks.setdefault(fingerprint, asyncio.Lock()):
+        # Envs completed by an earlier server run are picked up through the marker
+        if fingerprint in _env_cache or os.path.exists(marker):
+            _env_cache[fingerprint] = env_dir
+            try:
+                os.utime(marker)  # Keeps the env from being evicted as unused
+            except OSError:
+                pass
+            logger.info("[Notebook] Reusing environment %s for %d packages", fingerprint, len(packages))
+            return env_dir
+
+        logger.info("[Notebook] Installing %d packages into environment %s...", len(packages), fingerprint)
+        try:
+            # Also rebuilds over an earlier attempt that died part way through
+            if not os.path.exists(_env_kernel_json(env_dir)):
+                await asyncio.to_thread(_build_env, env_dir)
+            returncode, output = await _pip_install_requirements(_env_python(env_dir), packages)
+        except Exception as e:
+            logger.warning("[Notebook] Failed to build environment %s: %r", fingerprint, e)
+            return None
+
+        if returncode == 0:
+            with open(marker, "w"):
+                pass
+            _env_cache[fingerprint] = env_dir
+            logger.info("[Notebook] Successfully installed packages: %s", ", ".join(packages))
         else:
-            # It's a file
-            content = node.get("content", "")
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            with open(full_path, "w", encoding="utf-8") as f:
-                f.write(content)
-            files_written.append(full_path)
-            print(f"[Notebook] Written file: {full_path} ({len(content)} bytes)")
+            # Keep using the partial env for this session (as an in-kernel install would),
+            # but don't cache it, so the next session retries the install
+            logger.warning("[Notebook] Some packages may have failed to install:\n%s", output)
+        return env_dir
+
 
-    for node in files:
-        write_node(node, base_dir)
+async def _session_kernel(packages: list[str]) -> tuple[AsyncKernelManager, AsyncKernelClient, str | None]:
+    """Kernel for a new session: from a requirements env when packages are given, else from the pool.
 
-    print(f"[Notebook] Total files written: {len(files_written)}")
+    Returns (manager, client, env_dir); env_dir is None unless the env was used.
+    """
+    env_dir = await _requirements_env(packages) if packages else None
+    if env_dir:
+        km, kc = await _start_kernel(env_dir)
+    else:
+        km, kc = await _acquire_kernel()
+    return km, kc, env_dir
+
+
+async def shutdown_warm_pool() -> None:
+    """Stop pending pre-starts and shut down the kernels still waiting in the pool."""
+    for task in list(_warm_spawns):
+        task.cancel()
+    if _warm_pool is None:
+        return
+    while not _warm_pool.empty():
+        km, kc = _warm_pool.get_nowait()
+        kc.stop_channels()
+        await km.shutdown_kernel(now=True)
 
 
 async def create_kernel_session(
-    files: list[dict] | None = None,
+    files: Iterable[tuple[str, str | None]] | None = None,
     requirements_txt: str | None = None
 ) -> KernelSession:
     """
     Create a new Jupyter kernel session with optional project context.
 
     Args:
-        files: Optional file tree to write to the session's project directory.
-               This allows the notebook to import from project files and access datasets.
+        files: Optional (relative_path, content) entries to write to the session's project
+               directory, with content None for directories. This allows the notebook to import from project files and access datasets.
         requirements_txt: Optional contents of requirements.txt to install packages from.
     """
     session_id = str(uuid.uuid4())[:8]
+    packages = _parse_requirements(requirements_txt) if requirements_txt else []
 
     # Create temp directory for project files
     project_dir = None
     if files:
         project_dir = tempfile.mkdtemp(prefix=f"notebook_{session_id}_")
-        write_files_to_disk(files, project_dir)
-        print(f"[Notebook] Created project directory: {project_dir}")
-
-    # Create kernel manager
-    km = KernelManager(kernel_name='python3')
 
-    # Start kernel with project directory as cwd (if provided)
+    # Get the kernel while the project files are written; the project directory
+    # is applied by _init_project_environment, which needs no kernel restart
     if project_dir:
-        km.start_kernel(cwd=project_dir)
-    else:
-        km.start_kernel()
-
-    # Get async client
-    kc = km.client()
-    kc.start_channels()
-
-    # Wait for kernel to be ready
-    try:
-        await asyncio.wait_for(
-            asyncio.to_thread(kc.wait_for_ready),
-            timeout=30.0
+        results = await asyncio.gather(
+            _session_kernel(packages),
+            asyncio.to_thread(write_files_to_disk, files, project_dir),
+            return_exceptions=True,
         )
-    except asyncio.TimeoutError:
-        km.shutdown_kernel()
-        # Cleanup temp directory on failure
-        if project_dir:
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            if not isinstance(results[0], BaseException):
+                km, kc, _ = results[0]
+                kc.stop_channels()
+                await km.shutdown_kernel(now=True)
+            # Cleanup temp directory on failure
             shutil.rmtree(project_dir, ignore_errors=True)
-        raise RuntimeError("Kernel startup timed out")
+            raise errors[0]
+        km, kc, env_dir = results[0]
+        logger.debug("[Notebook] Wrote %d files to project directory: %s", results[1], project_dir)
+    else:
+        km, kc, env_dir = await _session_kernel(packages)
 
     session = KernelSession(
         session_id=session_id,
         kernel_manager=km,
         kernel_client=kc,
         project_dir=project_dir,
+        env_dir=env_dir,
+        python_executable=_env_python(env_dir) if env_dir else None,
     )
 
     kernel_sessions[session_id] = session
-    print(f"[Notebook] Created kernel session: {session_id}")
+    _touch_session(session)
+    logger.info("[Notebook] Created kernel session: %s", session_id)
 
-    # Initialize project directory in the kernel's Python environment
+    # Packages without an env (it could not be built) are installed into the kernel
+    install_packages = packages and env_dir is None
+
+    # Initialize project directory in the kernel's Python environment. When packages
+    # follow, the same cell reports the interpreter pip will run with; otherwise the
+    # setup rides along with the first cell, saving a round-trip (or all of it for
+    # sessions that never run one).
     if project_dir:
-        await _init_project_environment(session_id, project_dir)
+        if install_packages:
+            await _init_project_environment(session_id, project_dir, discover_executable=True)
+        else:
+            session.pending_init_code = _project_init_code(project_dir)
 
     # Install packages from requirements.txt if provided
-    if requirements_txt:
-        await _install_requirements(session_id, requirements_txt)
+    if install_packages:
+        await _install_requirements(session_id, packages)
 
     return session
 
 
-async def _init_project_environment(session_id: str, project_dir: str) -> None:
-    """Initialize the kernel's Python environment to use the project directory."""
-    # Escape backslashes for Windows paths
-    escaped_path = project_dir.replace("\\", "\\\\")
-
-    init_code = f'''
+def _project_init_code(project_dir: str) -> str:
+    """Code that points the kernel's sys.path and working directory at the project."""
+    return f'''
 import sys
 import os
 
@@ -156,18 +450,64 @@ os.chdir(project_dir)
 del project_dir
 '''
 
+
+async def _init_project_environment(session_id: str, project_dir: str, discover_executable: bool = False) -> None:
+    """Initialize the kernel's Python environment to use the project directory.
+
+    With discover_executable, also caches the kernel's sys.executable on the session.
+    """
+    init_code = _project_init_code(project_dir)
+    if discover_executable:
+        init_code += "print(sys.executable)\n"
+
     try:
         result = await execute_cell(session_id, init_code, timeout=10.0)
         if result["status"] == "ok":
-            print(f"[Notebook] Initialized project environment for session {session_id}")
+            logger.debug("[Notebook] Initialized project environment for session %s", session_id)
+            if discover_executable:
+                kernel_sessions[session_id].python_executable = _stdout_text(result) or None
         else:
-            print(f"[Notebook] Warning: Failed to initialize project environment")
+            logger.warning("[Notebook] Failed to initialize project environment for session %s", session_id)
     except Exception as e:
-        print(f"[Notebook] Error initializing project environment: {e}")
+        logger.warning("[Notebook] Error initializing project environment: %s", e)
 
 
-async def _install_requirements(session_id: str, requirements_txt: str) -> None:
-    """Install packages from requirements.txt content."""
+def _overlay_init_code(site_overlay: str) -> str:
+    """Code that puts a session's package overlay first on the kernel's sys.path."""
+    return f'''
+import sys as _sys
+if r"{site_overlay}" not in _sys.path:
+    _sys.path.insert(0, r"{site_overlay}")
+del _sys
+'''
+
+
+def pip_install_code(session_id: str, packages: list[str]) -> str:
+    """Cell code that installs packages for one session with the kernel's own pip.
+
+    A kernel running in a shared requirements env must not change it: other
+    sessions use it, and its fingerprint would no longer describe its contents.
+    Those sessions install into a private overlay directory ahead of the env on
+    sys.path instead.
+    """
+    session = kernel_sessions.get(session_id)
+    if not session:
+        raise ValueError(f"Session {session_id} not found")
+
+    packages_str = " ".join(f'"{pkg}"' for pkg in packages)
+    if session.env_dir is None:
+        return f"%pip install {packages_str}"
+
+    if session.site_overlay is None:
+        session.site_overlay = tempfile.mkdtemp(prefix=f"notebook_site_{session_id}_")
+    return (
+        f'%pip install --upgrade --target "{session.site_overlay}" {packages_str}\n'
+        + _overlay_init_code(session.site_overlay)
+    )
+
+
+def _parse_requirements(requirements_txt: str) -> list[str]:
+    """Requirement lines from requirements.txt content, without comments and options."""
     # Parse requirements.txt - extract package names, skip comments and empty lines
     packages = []
     for line in requirements_txt.strip().split('\n'):
@@ -179,14 +519,35 @@ async def _install_requirements(session_id: str, requirements_txt: str) -> None:
         if line.startswith('-'):
             continue
         packages.append(line)
-
-    if not packages:
-        print(f"[Notebook] No packages to install from requirements.txt")
-        return
-
-    print(f"[Notebook] Installing {len(packages)} packages from requirements.txt...")
-
-    # Build pip install command
+    return packages
+
+
+async def _install_requirements(session_id: str, packages: list[str]) -> None:
+    """Install packages into a running session's kernel environment."""
+    logger.info("[Notebook] Installing %d packages from requirements.txt...", len(packages))
+
+    # Run pip directly against the kernel's interpreter: one process, and none of
+    # pip's progress output has to travel over IOPub
+    session = kernel_sessions[session_id]
+    exe = await _kernel_executable(session)
+    if exe:
+        try:
+            returncode, output = await _pip_install_requirements(exe, packages)
+        except NotImplementedError:
+            # Event loop without subprocess support (e.g. SelectorEventLoop on Windows)
+            pass
+        except Exception as e:
+            logger.warning("[Notebook] Error installing packages: %s", e)
+            return
+        else:
+            if returncode == 0:
+                logger.info("[Notebook] Successfully installed packages: %s", ", ".join(packages))
+            else:
+                # Log error but don't fail session creation
+                logger.warning("[Notebook] Some packages may have failed to install:\n%s", output)
+            return
+
+    # Fallback: install from inside the kernel
     packages_str = " ".join(f'"{pkg}"' for pkg in packages)
     code = f"!pip install {packages_str} -q"
 
@@ -194,35 +555,229 @@ async def _install_requirements(session_id: str, requirements_txt: str) -> None:
         result = await execute_cell(session_id, code, timeout=300.0)
 
         if result["status"] == "ok":
-            print(f"[Notebook] Successfully installed packages: {', '.join(packages)}")
+            logger.info("[Notebook] Successfully installed packages: %s", ", ".join(packages))
         else:
             # Log error but don't fail session creation
-            print(f"[Notebook] Warning: Some packages may have failed to install")
+            logger.warning("[Notebook] Some packages may have failed to install")
             for output in result["outputs"]:
                 if output.get("text"):
-                    print(f"[Notebook] {output['text']}")
+                    logger.warning("[Notebook] %s", "".join(output["text"]))
     except Exception as e:
-        print(f"[Notebook] Error installing packages: {e}")
+        logger.warning("[Notebook] Error installing packages: %s", e)
+
+
+async def _kernel_executable(session: KernelSession) -> str | None:
+    """Return the kernel's sys.executable, asking the kernel once and caching it."""
+    if session.python_executable is None:
+        result = await execute_cell(session.session_id, "import sys; print(sys.executable)", timeout=10.0)
+        if result["status"] == "ok":
+            session.python_executable = _stdout_text(result) or None
+    return session.python_executable
+
+
+def _stdout_text(result: dict[str, Any]) -> str:
+    """Stripped stdout of an execute_cell result."""
+    return "".join(
+        "".join(output["text"]) for output in result["outputs"]
+        if output.get("output_type") == "stream" and output.get("name") == "stdout"
+    ).strip()
+
+
+async def _pip_install_requirements(exe: str, packages: list[str]) -> tuple[int, str]:
+    """Install packages with `exe -m pip` in a single invocation. Returns (returncode, output)."""
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+        f.write("\n".join(packages))
+        requirements_path = f.name
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            exe, "-m", "pip", "install", "-q", "--prefer-binary", "--no-input", "-r", requirements_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=300.0)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return -1, "pip install timed out after 300s"
+        return proc.returncode, stdout.decode("utf-8", errors="replace")
+    finally:
+        os.unlink(requirements_path)
 
 
 async def get_or_create_session(session_id: str | None = None) -> KernelSession:
     """Get existing session or create a new one."""
     if session_id and session_id in kernel_sessions:
         session = kernel_sessions[session_id]
-        session.last_activity = datetime.now()
+        _touch_session(session)
         return session
 
     return await create_kernel_session()
 
 
+async def _recv_iopub(kc: AsyncKernelClient) -> dict[str, Any]:
+    """Receive the next IOPub message, with its content still packed (see _content).
+
+    Awaits the socket directly: get_iopub_msg polls before every receive, which
+    costs nearly as much as the receive itself when a cell streams output.
+    """
+    # Relies on jupyter_client 8.x channel internals (a zmq.asyncio socket on the
+    # channel); fall back to the public API if a later version changes them
+    socket = getattr(kc.iopub_channel, "socket", None)
+    if socket is None:
+        return await kc.get_iopub_msg()
+    frames = await socket.recv_multipart()
+    _, frames = kc.session.feed_identities(frames)
+    return kc.session.deserialize(frames, content=False)
+
+
+def _content(kc: AsyncKernelClient, msg: dict[str, Any]) -> dict[str, Any] | None:
+    """Unpack the content of an IOPub message if _CellOutputs reads it.
+
+    Other messages are never decoded: execute_input echoes the cell's whole
+    source, and comm traffic from widgets can be large.
+    """
+    if msg['msg_type'] not in _CONTENT_MSG_TYPES:
+        return None
+    content = msg['content']
+    return content if isinstance(content, dict) else kc.session.unpack(content)
+
+
+def _send_pending_init(session: KernelSession) -> None:
+    """Queue the session's deferred project setup ahead of the cell about to run.
+
+    The reply is not awaited: the kernel runs requests in order, and a silent
+    request neither publishes execute_input nor aborts the requests behind it.
+    """
+    if session.pending_init_code is not None:
+        session.kernel_client.execute(session.pending_init_code, silent=True, store_history=False)
+        session.pending_init_code = None
+
+
+# IOPub message types whose content _CellOutputs.add uses
+_CONTENT_MSG_TYPES = frozenset({'status', 'stream', 'execute_result', 'display_data', 'error'})
+
+
+@dataclass
+class _CellOutputs:
+    """Outputs of one execute request, built from its IOPub messages."""
+    execution_count: int
+    outputs: list[dict] = field(default_factory=list)
+    status: str = "ok"
+    started: bool = False  # execute_input seen; aborted requests go idle without it
+    done: bool = False
+    stream_chars: int = 0  # Stream text kept so far
+    dropped_chars: int = 0  # Stream text dropped past MAX_STREAM_CHARS
+
+    def add(self, msg_type: str, content: dict[str, Any] | None) -> bool:
+        """Apply one IOPub message. Returns True once the request has finished."""
+        outputs = self.outputs
+
+        if msg_type == 'status':
+            if content['execution_state'] == 'idle':
+                # Execution complete
+                if not self.started:
+                    self.fail("ExecutionAborted", "Cell was not run because an earlier cell raised an error")
+                self.done = True
+                return True
+
+        elif msg_type == 'execute_input':
+            self.started = True
+
+        elif msg_type == 'stream':
+            # stdout/stderr output, capped per cell
+            text = content.get('text', '')
+            room = MAX_STREAM_CHARS - self.stream_chars
+            if len(text) > room:
+                self.dropped_chars += len(text) - room
+                text = text[:room]
+                if not text:
+                    return False
+            self.stream_chars += len(text)
+
+            # Consecutive chunks of one stream extend the same output
+            name = content.get('name', 'stdout')
+            last = outputs[-1] if outputs else None
+            if last is not None and last["output_type"] == "stream" and last["name"] == name:
+                last["text"].append(text)
+            else:
+                outputs.append({
+                    "output_type": "stream",
+                    "name": name,
+                    "text": [text]
+                })
+
+        elif msg_type == 'execute_result':
+            # Return value
+            outputs.append({
+                "output_type": "execute_result",
+                "execution_count": self.execution_count,
+                "data": content.get('data', {}),
+                "metadata": content.get('metadata', {})
+            })
+
+        elif msg_type == 'display_data':
+            # Display output (images, HTML, etc.)
+            outputs.append({
+                "output_type": "display_data",
+                "data": content.get('data', {}),
+                "metadata": content.get('metadata', {})
+            })
+
+        elif msg_type == 'error':
+            # Error output
+            outputs.append({
+                "output_type": "error",
+                "ename": content.get('ename', 'Error'),
+                "evalue": content.get('evalue', ''),
+                "traceback": content.get('traceback', [])
+            })
+            self.status = "error"
+
+        return False
+
+    def fail(self, ename: str, evalue: str) -> None:
+        """Record an error raised on our side rather than by the kernel."""
+        self.outputs.append({
+            "output_type": "error",
+            "ename": ename,
+            "evalue": evalue,
+            "traceback": [f"{ename}: {evalue}"]
+        })
+        self.status = "error"
+
+    def result(self) -> dict[str, Any]:
+        # Join each coalesced stream once, now that it is complete
+        for output in self.outputs:
+            if output["output_type"] == "stream" and len(output["text"]) > 1:
+                output["text"] = ["".join(output["text"])]
+        if self.dropped_chars:
+            self.outputs.append({
+                "output_type": "stream",
+                "name": "stderr",
+                "text": [f"\n[... output truncated: {self.dropped_chars} more characters ...]\n"]
+            })
+
+        return {
+            "execution_count": self.execution_count,
+            "outputs": self.outputs,
+            "status": self.status
+        }
+
+
 async def execute_cell(
     session_id: str,
     code: str,
-    timeout: float = 60.0
+    timeout: float = 60.0,
+    offload_outputs: bool = False
 ) -> dict[str, Any]:
     """
     Execute a code cell and return outputs.
 
+    With offload_outputs, large images and plots are written to files and
+    replaced by references (see _offload_outputs).
+
     Returns dict with:
     - execution_count: int
     - outputs: list of output objects
@@ -232,96 +787,136 @@ async def execute_cell(
     if not session:
         raise ValueError(f"Session {session_id} not found")
 
-    session.last_activity = datetime.now()
-    session.execution_count += 1
-    exec_count = session.execution_count
+    # Cells sent to the same session run one request at a time
+    async with session.exec_lock:
+        _touch_session(session)
+        session.execution_count += 1
+        cell = _CellOutputs(session.execution_count)
 
-    kc = session.kernel_client
-    outputs: list[dict] = []
-    status = "ok"
+        kc = session.kernel_client
 
-    # Execute the code
-    msg_id = kc.execute(code)
+        # Execute the code
+        _send_pending_init(session)
+        msg_id = kc.execute(code)
 
-    # Collect outputs
-    try:
-        while True:
-            try:
-                msg = await asyncio.wait_for(
-                    asyncio.to_thread(kc.get_iopub_msg),
-                    timeout=timeout
-                )
-            except asyncio.TimeoutError:
-                outputs.append({
-                    "output_type": "error",
-                    "ename": "TimeoutError",
-                    "evalue": f"Cell execution timed out after {timeout}s",
-                    "traceback": [f"TimeoutError: Cell execution timed out after {timeout}s"]
-                })
-                status = "error"
-                break
+        # Collect outputs. The timeout bounds the whole cell with a single timer,
+        # so a cell that keeps printing still times out.
+        try:
+            async with asyncio.timeout(timeout):
+                while True:
+                    msg = await _recv_iopub(kc)
 
-            msg_type = msg['header']['msg_type']
-            content = msg['content']
+                    # Check if this message is for our execution
+                    if msg['parent_header'].get('msg_id') != msg_id:
+                        continue
 
-            # Check if this message is for our execution
-            if msg['parent_header'].get('msg_id') != msg_id:
-                continue
+                    if cell.add(msg['msg_type'], _content(kc, msg)):
+                        break
 
-            if msg_type == 'status':
-                if content['execution_state'] == 'idle':
-                    # Execution complete
-                    break
+        except TimeoutError:
+            cell.fail("TimeoutError", f"Cell execution timed out after {timeout}s")
+        except Exception as e:
+            cell.fail(type(e).__name__, str(e))
 
-            elif msg_type == 'stream':
-                # stdout/stderr output
-                outputs.append({
-                    "output_type": "stream",
-                    "name": content.get('name', 'stdout'),
-                    "text": [content.get('text', '')]
-                })
+        result = cell.result()
+        if offload_outputs:
+            await asyncio.to_thread(_offload_outputs, session, result["outputs"])
+        return result
 
-            elif msg_type == 'execute_result':
-                # Return value
-                outputs.append({
-                    "output_type": "execute_result",
-                    "execution_count": exec_count,
-                    "data": content.get('data', {}),
-                    "metadata": content.get('metadata', {})
-                })
 
-            elif msg_type == 'display_data':
-                # Display output (images, HTML, etc.)
-                outputs.append({
-                    "output_type": "display_data",
-                    "data": content.get('data', {}),
-                    "metadata": content.get('metadata', {})
-                })
+async def execute_cells(
+    session_id: str,
+    codes: list[str],
+    timeout: float = 60.0,
+    offload_outputs: bool = False
+) -> list[dict[str, Any]]:
+    """
+    Execute several code cells in order and return their results in the same order.
 
-            elif msg_type == 'error':
-                # Error output
-                outputs.append({
-                    "output_type": "error",
-                    "ename": content.get('ename', 'Error'),
-                    "evalue": content.get('evalue', ''),
-                    "traceback": content.get('traceback', [])
-                })
-                status = "error"
+    All requests are submitted before any output is read, so the kernel starts each
+    cell as soon as the previous one finishes. If a cell raises, the kernel aborts
+    the cells queued after it; they come back with an ExecutionAborted error.
+    The timeout bounds the whole batch; offload_outputs is as for execute_cell.
+    """
+    session = kernel_sessions.get(session_id)
+    if not session:
+        raise ValueError(f"Session {session_id} not found")
 
-    except Exception as e:
-        outputs.append({
-            "output_type": "error",
-            "ename": type(e).__name__,
-            "evalue": str(e),
-            "traceback": [f"{type(e).__name__}: {e}"]
-        })
-        status = "error"
+    async with session.exec_lock:
+        _touch_session(session)
+        kc = session.kernel_client
+
+        _send_pending_init(session)
+        cells: dict[str, _CellOutputs] = {}
+        for code in codes:
+            session.execution_count += 1
+            cells[kc.execute(code)] = _CellOutputs(session.execution_count)
+
+        # Route each message to its cell by parent msg_id until every cell is idle
+        pending = len(cells)
+        try:
+            async with asyncio.timeout(timeout):
+                while pending:
+                    msg = await _recv_iopub(kc)
+                    cell = cells.get(msg['parent_header'].get('msg_id'))
+                    if cell is None or cell.done:
+                        continue
+                    if cell.add(msg['msg_type'], _content(kc, msg)):
+                        pending -= 1
+
+        except TimeoutError:
+            for cell in cells.values():
+                if not cell.done:
+                    cell.fail("TimeoutError", f"Batch execution timed out after {timeout}s")
+        except Exception as e:
+            for cell in cells.values():
+                if not cell.done:
+                    cell.fail(type(e).__name__, str(e))
+
+        results = [cell.result() for cell in cells.values()]
+        if offload_outputs:
+            await asyncio.to_thread(_offload_outputs, session, [o for r in results for o in r["outputs"]])
+        return results
+
+
+def _offload_outputs(session: KernelSession, outputs: list[dict]) -> None:
+    """Move large rich outputs to the session's outputs directory (runs in a worker thread).
+
+    Each moved MIME entry becomes {"$ref": "/sessions/{id}/outputs/{name}"}, a path
+    relative to the notebook API, so the payload no longer travels in the response.
+    """
+    for output in outputs:
+        data = output.get("data")
+        if not data:
+            continue
+        for mime, ext in OFFLOAD_MIME_TYPES.items():
+            value = data.get(mime)
+            if value is None:
+                continue
+            if isinstance(value, list):
+                value = "".join(value)
+            if isinstance(value, str):
+                payload = base64.b64decode(value) if mime.startswith("image/") else value.encode("utf-8")
+            else:
+                payload = orjson.dumps(value)
+            if len(payload) < OFFLOAD_MIN_SIZE:
+                continue
 
-    return {
-        "execution_count": exec_count,
-        "outputs": outputs,
-        "status": status
-    }
+            if session.outputs_dir is None:
+                session.outputs_dir = tempfile.mkdtemp(prefix=f"notebook_outputs_{session.session_id}_")
+            name = f"{uuid.uuid4().hex}{ext}"
+            with open(os.path.join(session.outputs_dir, name), "wb") as f:
+                f.write(payload)
+            data[mime] = {"$ref": f"/sessions/{session.session_id}/outputs/{name}"}
+
+
+def get_output_path(session_id: str, name: str) -> str | None:
+    """Path of an offloaded output file, or None if the session or file is unknown."""
+    session = kernel_sessions.get(session_id)
+    if not session or not session.outputs_dir:
+        return None
+    path = os.path.join(session.outputs_dir, os.path.basename(name))
+    return path if os.path.isfile(path) else None
 
 
 async def interrupt_kernel(session_id: str) -> bool:
@@ -331,10 +926,10 @@ async def interrupt_kernel(session_id: str) -> bool:
         return False
 
     try:
-        session.kernel_manager.interrupt_kernel()
+        await session.kernel_manager.interrupt_kernel()
         return True
     except Exception as e:
-        print(f"[Notebook] Failed to interrupt kernel: {e}")
+        logger.warning("[Notebook] Failed to interrupt kernel: %s", e)
         return False
 
 
@@ -345,23 +940,27 @@ async def restart_kernel(session_id: str) -> bool:
         return False
 
     try:
-        session.kernel_manager.restart_kernel()
+        await session.kernel_manager.restart_kernel()
         session.execution_count = 0
-        session.last_activity = datetime.now()
+        _touch_session(session)
 
         # Wait for kernel to be ready
         await asyncio.wait_for(
-            asyncio.to_thread(session.kernel_client.wait_for_ready),
+            session.kernel_client.wait_for_ready(),
             timeout=30.0
         )
 
-        # Re-initialize project environment if it was set up
+        # Re-initialize project environment and installed packages with the next cell
+        init_code = ""
         if session.project_dir:
-            await _init_project_environment(session_id, session.project_dir)
+            init_code += _project_init_code(session.project_dir)
+        if session.site_overlay:
+            init_code += _overlay_init_code(session.site_overlay)
+        session.pending_init_code = init_code or None
 
         return True
     except Exception as e:
-        print(f"[Notebook] Failed to restart kernel: {e}")
+        logger.warning("[Notebook] Failed to restart kernel: %s", e)
         return False
 
 
@@ -373,23 +972,34 @@ async def shutdown_kernel(session_id: str) -> bool:
 
     try:
         session.kernel_client.stop_channels()
-        session.kernel_manager.shutdown_kernel()
-        print(f"[Notebook] Shutdown kernel session: {session_id}")
+        await session.kernel_manager.shutdown_kernel()
+        logger.info("[Notebook] Shutdown kernel session: %s", session_id)
 
         # Cleanup project directory if it exists
         if session.project_dir:
             try:
                 shutil.rmtree(session.project_dir, ignore_errors=True)
-                print(f"[Notebook] Cleaned up project directory: {session.project_dir}")
+                logger.debug("[Notebook] Cleaned up project directory: %s", session.project_dir)
             except Exception as cleanup_error:
-                print(f"[Notebook] Warning: Failed to cleanup project directory: {cleanup_error}")
+                logger.warning("[Notebook] Failed to cleanup project directory: %s", cleanup_error)
+
+        if session.outputs_dir:
+            shutil.rmtree(session.outputs_dir, ignore_errors=True)
+        if session.site_overlay:
+            shutil.rmtree(session.site_overlay, ignore_errors=True)
 
         return True
     except Exception as e:
-        print(f"[Notebook] Error during kernel shutdown: {e}")
+        logger.warning("[Notebook] Error during kernel shutdown: %s", e)
         return False
 
 
+def _last_activity_iso(session: KernelSession) -> str:
+    """Wall-clock time of the session's latest activity."""
+    idle = time.monotonic() - session.last_activity_mono
+    return (datetime.now() - timedelta(seconds=idle)).isoformat()
+
+
 async def get_kernel_info(session_id: str) -> dict[str, Any] | None:
     """Get information about a kernel session."""
     session = kernel_sessions.get(session_id)
@@ -400,24 +1010,24 @@ async def get_kernel_info(session_id: str) -> dict[str, Any] | None:
         "session_id": session.session_id,
         "execution_count": session.execution_count,
         "created_at": session.created_at.isoformat(),
-        "last_activity": session.last_activity.isoformat(),
-        "is_alive": session.kernel_manager.is_alive(),
+        "last_activity": _last_activity_iso(session),
+        "is_alive": await session.kernel_manager.is_alive(),
         "has_project": session.project_dir is not None,
     }
 
 
-def list_sessions() -> list[dict[str, Any]]:
+async def list_sessions() -> list[dict[str, Any]]:
     """List all active kernel sessions."""
     return [
         {
             "session_id": s.session_id,
             "execution_count": s.execution_count,
             "created_at": s.created_at.isoformat(),
-            "last_activity": s.last_activity.isoformat(),
-            "is_alive": s.kernel_manager.is_alive(),
+            "last_activity": _last_activity_iso(s),
+            "is_alive": await s.kernel_manager.is_alive(),
             "has_project": s.project_dir is not None,
         }
-        for s in kernel_sessions.values()
+        for s in list(kernel_sessions.values())
     ]
 
 
@@ -440,37 +1050,34 @@ async def update_session_file(session_id: str, file_path: str, content: str) ->
     # Sanitize path to prevent directory traversal
     file_path = file_path.replace("\\", "/").lstrip("/")
     if ".." in file_path:
-        print(f"[Notebook] Invalid file path (directory traversal): {file_path}")
+        logger.warning("[Notebook] Invalid file path (directory traversal): %s", file_path)
         return False
 
     full_path = os.path.join(session.project_dir, file_path)
 
     try:
-        # Ensure parent directory exists
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-
-        # Write the updated content
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        # Write the updated content off the event loop, creating the parent
+        # directory if it is missing
+        await asyncio.to_thread(write_file, full_path, content.encode("utf-8"), make_parent=True)
 
-        print(f"[Notebook] Updated file in session {session_id}: {file_path}")
-        session.last_activity = datetime.now()
+        logger.debug("[Notebook] Updated file in session %s: %s", session_id, file_path)
+        _touch_session(session)
         return True
     except Exception as e:
-        print(f"[Notebook] Error updating file: {e}")
+        logger.warning("[Notebook] Error updating file: %s", e)
         return False
 
 
 async def cleanup_idle_sessions(max_idle_minutes: int = 30):
     """Cleanup sessions that have been idle for too long."""
-    now = datetime.now()
-    to_remove = []
+    cutoff = time.monotonic() - max_idle_minutes * 60
 
-    for session_id, session in kernel_sessions.items():
-        idle_minutes = (now - session.last_activity).total_seconds() / 60
-        if idle_minutes > max_idle_minutes:
-            to_remove.append(session_id)
+    # Only the expired prefix of the heap is visited
+    while _idle_heap and _idle_heap[0][0] < cutoff:
+        stamp, session_id = heapq.heappop(_idle_heap)
+        session = kernel_sessions.get(session_id)
+        if session is None or session.last_activity_mono != stamp:
+            continue  # Session gone or touched again since this entry was pushed
 
-    for session_id in to_remove:
         await shutdown_kernel(session_id)
-        print(f"[Notebook] Cleaned up idle session: {session_id}")
+        logger.info("[Notebook] Cleaned up idle session: %s", session_id)